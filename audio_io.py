@@ -0,0 +1,164 @@
+import logging
+from typing import Optional
+
+import librosa
+import numpy as np
+import soundfile as sf
+from scipy.signal import firwin, resample_poly
+
+logger = logging.getLogger(__name__)
+
+TELEPHONY_RATE = 8000
+# Whisper's input rate
+SAMPLE_RATE = 16000
+
+# Raw (headerless) payload content types and the codec they carry
+RAW_CONTENT_TYPES = {
+    "audio/l16": "l16",
+    "audio/pcmu": "ulaw",
+    "audio/basic": "ulaw",
+    "audio/x-mulaw": "ulaw",
+    "audio/mulaw": "ulaw",
+    "audio/pcma": "alaw",
+    "audio/x-alaw": "alaw",
+    "audio/alaw": "alaw",
+}
+
+# G.711 codecs default to 8 kHz; L16 has no sensible default and must declare its rate
+DEFAULT_RAW_RATES = {"ulaw": TELEPHONY_RATE, "alaw": TELEPHONY_RATE}
+
+
+def _ulaw_table() -> np.ndarray:
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    mantissa = u & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return (np.where(u & 0x80, -magnitude, magnitude) / 32768.0).astype(np.float32)
+
+
+def _alaw_table() -> np.ndarray:
+    a = np.arange(256, dtype=np.int32) ^ 0x55
+    exponent = (a >> 4) & 0x07
+    mantissa = a & 0x0F
+    magnitude = np.where(
+        exponent == 0,
+        (mantissa << 4) + 8,
+        ((mantissa << 4) + 0x108) << np.maximum(exponent - 1, 0),
+    )
+    return (np.where(a & 0x80, magnitude, -magnitude) / 32768.0).astype(np.float32)
+
+
+# Byte -> float32 sample lookup tables for G.711
+ULAW_TABLE = _ulaw_table()
+ALAW_TABLE = _alaw_table()
+
+# Fixed anti-imaging filter for 2x polyphase upsampling (same design resample_poly uses by default)
+_UPSAMPLE_2X_FILTER = firwin(41, 0.5, window=("kaiser", 5.0))
+
+
+def parse_content_type(content_type: Optional[str]) -> tuple:
+    """Split 'audio/L16; rate=8000' into ('audio/l16', {'rate': '8000'})."""
+    if not content_type:
+        return "", {}
+    mime, *params = [part.strip() for part in content_type.split(";")]
+    parsed = {}
+    for param in params:
+        key, _, value = param.partition("=")
+        parsed[key.strip().lower()] = value.strip().strip('"')
+    return mime.lower(), parsed
+
+
+def raw_codec(content_type: Optional[str]) -> Optional[str]:
+    return RAW_CONTENT_TYPES.get(parse_content_type(content_type)[0])
+
+
+def raw_format(content_type: Optional[str]) -> tuple:
+    """
+    (codec, sample_rate, byte_order) of a raw payload content type such as
+    'audio/L16; rate=8000'. sample_rate is None when neither the content type nor
+    the codec defines one.
+    """
+    mime, params = parse_content_type(content_type)
+    codec = RAW_CONTENT_TYPES[mime]
+    rate = params.get("rate") or DEFAULT_RAW_RATES.get(codec)
+    try:
+        rate = int(rate) if rate else None
+    except ValueError:
+        raise ValueError(f"Invalid sample rate in content type: {rate!r}")
+    if rate is not None and rate <= 0:
+        raise ValueError(f"Sample rate must be positive, got {rate}")
+    byte_order = "little" if params.get("endianness", "").startswith("little") else "big"
+    return codec, rate, byte_order
+
+
+def decode_raw(data: bytes, codec: str, byte_order: str = "big") -> np.ndarray:
+    """Decode headerless samples straight into float32: G.711, 16-bit PCM or 32-bit float."""
+    if codec == "ulaw":
+        return ULAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+    if codec == "alaw":
+        return ALAW_TABLE[np.frombuffer(data, dtype=np.uint8)]
+    if codec == "l16":
+        if len(data) % 2:
+            raise ValueError("L16 payload has an odd number of bytes")
+        dtype = ">i2" if byte_order == "big" else "<i2"
+        return np.frombuffer(data, dtype=dtype).astype(np.float32) / 32768.0
+    if codec == "f32":
+        dtype = ">f4" if byte_order == "big" else "<f4"
+        return np.frombuffer(data, dtype=dtype).astype(np.float32)
+    raise ValueError(f"Unsupported raw codec: {codec}")
+
+
+def sniff_container(head: bytes) -> Optional[str]:
+    """Identify an audio container from its first 12 bytes; None if unrecognised."""
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"RIFX" and head[8:12] == b"WAVE":
+        return "rifx"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head[:3] == b"ID3" or (len(head) >= 2 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+def read_container(source) -> tuple:
+    """Read a WAV/FLAC file with libsndfile, downmixing to mono like librosa.load."""
+    audio, sample_rate = sf.read(source, dtype="float32", always_2d=True)
+    return audio.mean(axis=1), sample_rate
+
+
+def upsample_8k_to_16k(audio: np.ndarray) -> np.ndarray:
+    return resample_poly(audio, 2, 1, window=_UPSAMPLE_2X_FILTER).astype(np.float32)
+
+
+def preprocess_audio(audio: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    The server's preprocessing before model.transcribe: peak-normalize, noise gate,
+    pad 1 second of silence at both ends and resample to 16 kHz float32.
+    """
+    logger.info(f"Original audio sampling rate: {sample_rate} Hz")
+
+    # Normalize
+    peak = np.max(np.abs(audio)) if len(audio) else 0
+    audio = audio / peak if peak > 0 else audio
+
+    # Denoise with noise gate
+    audio = np.where(np.abs(audio) < 0.015, 0, audio)
+
+    # Pad 1 second silence at start and end
+    silence = np.zeros(int(sample_rate), dtype=audio.dtype)
+    audio = np.concatenate([silence, audio, silence])
+
+    # Resample if needed
+    if sample_rate == TELEPHONY_RATE:
+        logger.info("Upsampling 8000 Hz to 16000 Hz...")
+        audio = upsample_8k_to_16k(audio)
+    elif sample_rate != SAMPLE_RATE:
+        logger.info("Resampling to 16000 Hz...")
+        audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=SAMPLE_RATE)
+
+    return audio.astype(np.float32)
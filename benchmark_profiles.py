@@ -0,0 +1,94 @@
+import os
+import re
+import time
+import argparse
+
+import whisper_at as whisper
+
+from audio_io import preprocess_audio
+from decoding_profiles import PROFILES, get_profile, install_repetition_guard, use_profile
+from upload_stream import decode_file
+
+AUDIO_EXTENSIONS = (".mp3", ".wav", ".m4a", ".flac", ".ogg")
+
+
+def normalize_words(text):
+    text = re.sub(r"[^a-z0-9'\s]", " ", text.lower())
+    return text.split()
+
+
+def word_errors(reference, hypothesis):
+    """Word-level edit distance between two word lists."""
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_word in enumerate(reference, start=1):
+        current = [i] + [0] * len(hypothesis)
+        for j, hyp_word in enumerate(hypothesis, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1]
+
+
+def load_corpus(corpus_dir):
+    """
+    Tuples of (audio_path, samples, duration, reference_text); references are <name>.txt next to
+    <name>.<ext>. Samples are decoded and preprocessed the way /transcribe/ does it.
+    """
+    corpus = []
+    for name in sorted(os.listdir(corpus_dir)):
+        stem, ext = os.path.splitext(name)
+        reference_path = os.path.join(corpus_dir, stem + ".txt")
+        if ext.lower() in AUDIO_EXTENSIONS and os.path.exists(reference_path):
+            with open(reference_path, encoding="utf-8") as f:
+                reference = f.read()
+            path = os.path.join(corpus_dir, name)
+            audio, sample_rate = decode_file(path)
+            corpus.append((path, preprocess_audio(audio, sample_rate), len(audio) / sample_rate, reference))
+    return corpus
+
+
+def main():
+    """Measure real-time factor and WER of each decoding profile on a local corpus"""
+    parser = argparse.ArgumentParser(description="Whisper-AT decoding profile benchmark")
+    parser.add_argument("corpus", help="Directory of audio files with matching .txt references")
+    parser.add_argument("--model", default="medium.en", help="Whisper-AT model name (default: medium.en)")
+    parser.add_argument("--profiles", default=",".join(PROFILES), help="Comma-separated profiles to compare (default: all)")
+    parser.add_argument("--no-speech", type=float, default=0.4, help="No speech threshold (default: 0.4)")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        print(f"No audio files with .txt references found in {args.corpus}")
+        return
+
+    model = install_repetition_guard(whisper.load_model(args.model))
+    total_audio = sum(duration for _, _, duration, _ in corpus)
+    print(f"{len(corpus)} files, {total_audio:.1f} s of audio")
+    print(f"{'profile':>14} {'RTF':>8} {'WER':>8}")
+
+    for name in args.profiles.split(","):
+        profile = get_profile(name)
+        # Warm up so the first file does not pay for lazy initialisation
+        with use_profile(profile):
+            model.transcribe(corpus[0][1], no_speech_threshold=args.no_speech, **profile.transcribe_options())
+
+        elapsed, errors, reference_words = 0.0, 0, 0
+        for _, audio, _, reference in corpus:
+            start = time.perf_counter()
+            with use_profile(profile):
+                result = model.transcribe(audio, no_speech_threshold=args.no_speech, **profile.transcribe_options())
+            elapsed += time.perf_counter() - start
+
+            reference = normalize_words(reference)
+            errors += word_errors(reference, normalize_words(result.get("text", "")))
+            reference_words += len(reference)
+
+        wer = errors / reference_words if reference_words else 0.0
+        print(f"{name:>14} {elapsed / total_audio:>8.3f} {wer:>8.2%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import time
+import argparse
+import multiprocessing as mp
+
+import resources
+
+
+def run_worker(index, workers, threads, pin, audio_file, model_name, repeats, barrier, results):
+    """Load the model in a fresh process laid out like a server worker and time it."""
+    plan = resources.plan_resources(workers, index, pin=pin, threads=threads)
+    for var in resources.THREAD_ENV_VARS:
+        os.environ[var] = str(plan.intra_op_threads)
+    resources.apply_thread_env(plan)
+
+    import soundfile as sf
+    import whisper_at as whisper
+
+    resources.apply_torch_threads(plan)
+    model = whisper.load_model(model_name)
+    duration = sf.info(audio_file).duration
+
+    # Warm up outside the timed region
+    model.transcribe(audio_file, at_time_res=10, temperature=0.0)
+    barrier.wait()
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model.transcribe(audio_file, at_time_res=10, temperature=0.0)
+    results.put((time.perf_counter() - start, duration * repeats))
+
+
+def run_config(workers, threads, pin, audio_file, model_name, repeats):
+    ctx = mp.get_context("spawn")
+    barrier = ctx.Barrier(workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(
+            target=run_worker,
+            args=(i, workers, threads, pin, audio_file, model_name, repeats, barrier, results),
+        )
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    timings = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+
+    wall = max(elapsed for elapsed, _ in timings)
+    audio_seconds = sum(seconds for _, seconds in timings)
+    return audio_seconds / wall
+
+
+def main():
+    """Sweep workers x threads-per-worker and report transcription throughput"""
+    parser = argparse.ArgumentParser(description="Whisper-AT CPU thread layout benchmark")
+    parser.add_argument("--audio", default="test.wav", help="Audio file to transcribe (default: test.wav)")
+    parser.add_argument("--model", default="medium.en", help="Whisper-AT model name (default: medium.en)")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts (default: 1,2,4)")
+    parser.add_argument("--threads", default="1,2,4,8", help="Comma-separated threads per worker (default: 1,2,4,8)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed transcriptions per worker (default: 3)")
+    parser.add_argument("--pin", action="store_true", help="Pin each worker to its core slice")
+    args = parser.parse_args()
+
+    total_cores = len(resources.available_cores())
+    print(f"Available cores: {total_cores}")
+    print(f"{'workers':>8} {'threads':>8} {'audio s / s':>12}")
+
+    best = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        for threads in [int(t) for t in args.threads.split(",")]:
+            if workers * threads > total_cores:
+                continue
+            throughput = run_config(workers, threads, args.pin, args.audio, args.model, args.repeats)
+            print(f"{workers:>8} {threads:>8} {throughput:>12.2f}")
+            if best is None or throughput > best[2]:
+                best = (workers, threads, throughput)
+
+    if best:
+        print(f"Best: WORKERS={best[0]} with {best[1]} threads per worker ({best[2]:.2f} audio s / s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+# Reasons a request can be abandoned
+REASON_DISCONNECTED = "disconnected"
+REASON_EXPIRED = "expired"
+
+
+class InferenceCancelled(Exception):
+    """Raised inside the inference thread when the caller has given up."""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Inference cancelled: {reason}")
+        self.reason = reason
+
+
+class CancelToken:
+    """
+    Per-request cancellation state shared between the event loop and the
+    inference thread. The deadline is an absolute time.monotonic() value.
+    """
+
+    def __init__(self, deadline: Optional[float] = None):
+        self.deadline = deadline
+        self._reason = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_timeout(cls, timeout: Optional[float]) -> "CancelToken":
+        if timeout is None:
+            return cls()
+        return cls(deadline=time.monotonic() + timeout)
+
+    def tighten(self, timeout: Optional[float]):
+        """Bring the deadline forward to `timeout` seconds from now, never push it back."""
+        if timeout is None:
+            return
+        deadline = time.monotonic() + timeout
+        if self.deadline is None or deadline < self.deadline:
+            self.deadline = deadline
+
+    def cancel(self, reason: str = REASON_DISCONNECTED):
+        with self._lock:
+            if self._reason is None:
+                self._reason = reason
+
+    def remaining(self) -> Optional[float]:
+        if self.deadline is None:
+            return None
+        return self.deadline - time.monotonic()
+
+    @property
+    def reason(self) -> Optional[str]:
+        if self._reason is None and self.deadline is not None and self.remaining() <= 0:
+            self.cancel(REASON_EXPIRED)
+        return self._reason
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def check(self):
+        reason = self.reason
+        if reason is not None:
+            raise InferenceCancelled(reason)
+
+
+class CancellationStats:
+    """Thread-safe counters for abandoned work, split by reason and stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {
+            "cancelled_queued": 0,
+            "cancelled_running": 0,
+            "expired_queued": 0,
+            "expired_running": 0,
+        }
+
+    def record(self, reason: str, running: bool):
+        kind = "expired" if reason == REASON_EXPIRED else "cancelled"
+        key = f"{kind}_{'running' if running else 'queued'}"
+        with self._lock:
+            self._counts[key] += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+# Token bound to the current inference thread, if any
+_local = threading.local()
+
+
+@contextmanager
+def bind_token(token: CancelToken):
+    previous = getattr(_local, "token", None)
+    _local.token = token
+    try:
+        yield token
+    finally:
+        _local.token = previous
+
+
+def install_window_hook(model):
+    """
+    Wrap model.decode so the token bound to the calling thread is checked
+    before every 30-second window. whisper_at's transcribe loop calls
+    model.decode once per window (and per temperature fallback), which makes
+    it the natural point to abort running work cooperatively.
+    """
+    decode = model.decode
+
+    def guarded_decode(segment, options):
+        token = getattr(_local, "token", None)
+        if token is not None:
+            token.check()
+        return decode(segment, options)
+
+    model.decode = guarded_decode
+    return model
+
+
+def parse_timeout(*values) -> Optional[float]:
+    """Return the tightest positive timeout (in seconds) among the given values."""
+    timeouts = []
+    for value in values:
+        if value is None or value == "":
+            continue
+        try:
+            timeout = float(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid timeout value: {value!r}")
+        if timeout <= 0:
+            raise ValueError(f"Timeout must be positive, got {value!r}")
+        timeouts.append(timeout)
+    return min(timeouts) if timeouts else None
@@ -35,8 +35,11 @@ class WhisperATClient:
         self, 
         audio_file_path: str, 
         audio_tagging_time_resolution: int = 10,
-        temperature: float = 0.01,
+        temperature: Optional[float] = None,
         no_speech_threshold: float = 0.4,
+        deadline_seconds: Optional[float] = None,
+        decoding_profile: Optional[str] = None,
+        sample_rate: Optional[int] = None,
         output_file: Optional[str] = None,
         verbose: bool = False
     ) -> Dict[str, Any]:
@@ -46,8 +49,11 @@ class WhisperATClient:
         Args:
             audio_file_path: Path to the audio file
             audio_tagging_time_resolution: Temporal resolution for audio tagging in seconds
-            temperature: Temperature for sampling
+            temperature: Optional starting temperature; defaults to the decoding profile's
             no_speech_threshold: Threshold for determining no speech
+            deadline_seconds: Optional deadline after which the server abandons the request
+            decoding_profile: Optional decoding profile name (fast-greedy, balanced, accurate-beam)
+            sample_rate: Sample rate of raw .ulaw/.alaw/.l16 files (G.711 defaults to 8000 Hz)
             output_file: Optional path to save the transcription results as JSON
             verbose: Whether to print progress information
             
@@ -67,9 +73,16 @@ class WhisperATClient:
         
         data = {
             'audio_tagging_time_resolution': str(audio_tagging_time_resolution),
-            'temperature': str(temperature),
             'no_speech_threshold': str(no_speech_threshold)
         }
+        if temperature is not None:
+            data['temperature'] = str(temperature)
+        if deadline_seconds is not None:
+            data['deadline_seconds'] = str(deadline_seconds)
+        if decoding_profile is not None:
+            data['decoding_profile'] = decoding_profile
+        if sample_rate is not None:
+            data['sample_rate'] = str(sample_rate)
         
         try:
             # Send the request
@@ -134,7 +147,10 @@ class WhisperATClient:
             '.wav': 'audio/wav',
             '.m4a': 'audio/m4a',
             '.flac': 'audio/flac',
-            '.ogg': 'audio/ogg'
+            '.ogg': 'audio/ogg',
+            '.ulaw': 'audio/PCMU',
+            '.alaw': 'audio/PCMA',
+            '.l16': 'audio/L16'
         }
         
         return content_types.get(extension, 'application/octet-stream')
@@ -147,8 +163,11 @@ def main():
     parser.add_argument("audio_file", help="Path to the audio file to transcribe")
     parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the Whisper-AT API (default: http://localhost:8000)")
     parser.add_argument("--time-res", type=int, default=10, help="Audio tagging time resolution in seconds (default: 10)")
-    parser.add_argument("--temp", type=float, default=0.01, help="Temperature for sampling (default: 0.01)")
+    parser.add_argument("--temp", type=float, help="Starting temperature (default: the decoding profile's)")
     parser.add_argument("--no-speech", type=float, default=0.4, help="No speech threshold (default: 0.4)")
+    parser.add_argument("--deadline", type=float, help="Seconds after which the server abandons the request")
+    parser.add_argument("--profile", help="Decoding profile: fast-greedy, balanced or accurate-beam (default: server default)")
+    parser.add_argument("--sample-rate", type=int, help="Sample rate of raw .ulaw/.alaw/.l16 input")
     parser.add_argument("--output", help="Path to save the transcription results as JSON")
     parser.add_argument("--verbose", action="store_true", help="Print detailed information")
     
@@ -169,6 +188,9 @@ def main():
             audio_tagging_time_resolution=args.time_res,
             temperature=args.temp,
             no_speech_threshold=args.no_speech,
+            deadline_seconds=args.deadline,
+            decoding_profile=args.profile,
+            sample_rate=args.sample_rate,
             output_file=args.output,
             verbose=args.verbose
         )
@@ -0,0 +1,181 @@
+import math
+import contextvars
+from contextlib import contextmanager
+from typing import Optional
+
+# Profile whose repetition guard applies to decoding in the current context
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+
+TEMPERATURE_FALLBACK = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+class DecodingProfile:
+    """
+    Named set of decoding options passed to model.transcribe, plus the guards that
+    stop a 30-second window early: a per-window token cap (`sample_len`) and a
+    repetition-loop detector that forces end-of-text once the same n-gram has been
+    emitted `max_repeats` times in a row and the loop spans at least `min_loop_tokens`.
+    """
+
+    def __init__(self, name: str, temperature=0.0, beam_size: Optional[int] = None,
+                 best_of: Optional[int] = None, condition_on_previous_text: bool = True,
+                 sample_len: Optional[int] = None, compression_ratio_threshold: Optional[float] = 2.4,
+                 logprob_threshold: Optional[float] = -1.0, max_ngram: int = 8, max_repeats: int = 4,
+                 min_loop_tokens: int = 16):
+        self.name = name
+        self.temperature = temperature
+        self.beam_size = beam_size
+        self.best_of = best_of
+        self.condition_on_previous_text = condition_on_previous_text
+        self.sample_len = sample_len
+        self.compression_ratio_threshold = compression_ratio_threshold
+        self.logprob_threshold = logprob_threshold
+        self.max_ngram = max_ngram
+        self.max_repeats = max_repeats
+        self.min_loop_tokens = min_loop_tokens
+
+    def temperatures(self, temperature: Optional[float] = None):
+        """
+        Profile temperatures, starting from the caller's temperature if one was given.
+        whisper_at only uses beam search at temperature 0, so beam profiles reject any other
+        starting temperature rather than silently falling back to sampling.
+        """
+        schedule = self.temperature if isinstance(self.temperature, tuple) else (self.temperature,)
+        if temperature is None:
+            return schedule
+        if self.beam_size is not None and temperature != 0:
+            raise ValueError(f"Decoding profile '{self.name}' uses beam search, which requires temperature 0")
+        return (temperature,) + tuple(t for t in schedule if t > temperature)
+
+    def transcribe_options(self, temperature: Optional[float] = None) -> dict:
+        temperatures = self.temperatures(temperature)
+        options = {
+            "temperature": temperatures[0] if len(temperatures) == 1 else temperatures,
+            "condition_on_previous_text": self.condition_on_previous_text,
+            "compression_ratio_threshold": self.compression_ratio_threshold,
+            "logprob_threshold": self.logprob_threshold,
+        }
+        if self.beam_size is not None:
+            options["beam_size"] = self.beam_size
+        if self.best_of is not None:
+            options["best_of"] = self.best_of
+        if self.sample_len is not None:
+            options["sample_len"] = self.sample_len
+        return options
+
+    def as_dict(self) -> dict:
+        return {
+            "temperature": self.temperature,
+            "beam_size": self.beam_size,
+            "best_of": self.best_of,
+            "condition_on_previous_text": self.condition_on_previous_text,
+            "sample_len": self.sample_len,
+            "compression_ratio_threshold": self.compression_ratio_threshold,
+            "logprob_threshold": self.logprob_threshold,
+            "max_ngram": self.max_ngram,
+            "max_repeats": self.max_repeats,
+            "min_loop_tokens": self.min_loop_tokens,
+        }
+
+
+PROFILES = {
+    # Greedy, no fallback or cross-window prompt, short windows capped hard
+    "fast-greedy": DecodingProfile(
+        "fast-greedy", temperature=0.0, condition_on_previous_text=False,
+        sample_len=128, max_repeats=3,
+    ),
+    # Same decoding the server has always used, with the early-termination guards
+    "balanced": DecodingProfile(
+        "balanced", temperature=0.0, sample_len=192,
+    ),
+    # Beam search with the full Whisper temperature fallback
+    "accurate-beam": DecodingProfile(
+        "accurate-beam", temperature=TEMPERATURE_FALLBACK, beam_size=5, best_of=5,
+    ),
+}
+
+
+def get_profile(name: str) -> DecodingProfile:
+    try:
+        return PROFILES[name]
+    except KeyError:
+        raise ValueError(f"Unknown decoding profile '{name}'. Available profiles: {', '.join(PROFILES)}")
+
+
+def find_repetition(tokens: list, max_ngram: int, max_repeats: int, min_loop_tokens: int = 0) -> bool:
+    """
+    True if the tail of `tokens` is one n-gram repeated at least `max_repeats` times
+    and at least `min_loop_tokens` long, so short n-grams need more repeats.
+    """
+    for n in range(1, max_ngram + 1):
+        repeats = max(max_repeats, math.ceil(min_loop_tokens / n))
+        span = n * repeats
+        if len(tokens) < span:
+            continue
+        tail = tokens[-span:]
+        gram = tail[-n:]
+        if all(tail[i:i + n] == gram for i in range(0, span - n, n)):
+            return True
+    return False
+
+
+class RepetitionGuard:
+    """
+    whisper_at LogitFilter that ends a window once its text tokens fall into a
+    repetition loop. Timestamp and special tokens are ignored so loops that only
+    differ in their timestamps are still caught.
+    """
+
+    def __init__(self, tokenizer, sample_begin: int, profile: DecodingProfile):
+        self.eot = tokenizer.eot
+        self.sample_begin = sample_begin
+        self.max_ngram = profile.max_ngram
+        self.max_repeats = profile.max_repeats
+        self.min_loop_tokens = profile.min_loop_tokens
+
+    def apply(self, logits, tokens):
+        if tokens.shape[-1] - self.sample_begin < self.max_repeats:
+            return
+        for row, sequence in enumerate(tokens[:, self.sample_begin:].tolist()):
+            text_tokens = [t for t in sequence if t < self.eot]
+            if find_repetition(text_tokens, self.max_ngram, self.max_repeats, self.min_loop_tokens):
+                logits[row, :] = -float("inf")
+                logits[row, self.eot] = 0
+
+
+def install_repetition_guard(model):
+    """
+    Replace model.decode with a version that adds RepetitionGuard to the decoding
+    task's logit filters when a profile is active in the calling context.
+    """
+    import torch
+    from whisper_at.decoding import DecodingTask
+
+    decode = model.decode
+
+    @torch.no_grad()
+    def guarded_decode(mel, options):
+        profile = _active_profile.get()
+        if profile is None:
+            return decode(mel, options)
+
+        single = mel.ndim == 2
+        if single:
+            mel = mel.unsqueeze(0)
+        task = DecodingTask(model, options)
+        task.logit_filters.append(RepetitionGuard(task.tokenizer, task.sample_begin, profile))
+        result = task.run(mel)
+        return result[0] if single else result
+
+    model.decode = guarded_decode
+    return model
+
+
+@contextmanager
+def use_profile(profile: DecodingProfile):
+    """Enable the profile's repetition guard for decoding in this context."""
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
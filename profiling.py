@@ -0,0 +1,308 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+# Trace of the request being profiled in the current context (None = not profiled).
+# Context variables follow the request into run_in_threadpool workers.
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+MAX_TRACES = int(os.getenv("PROFILE_MAX_TRACES", "20"))
+TOP_OPERATORS = 50
+
+
+class RequestTrace:
+    """Spans and torch operator totals collected for one profiled request."""
+
+    def __init__(self, name: str):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.started_at = time.time()
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self.spans = []  # (name, start_us, end_us, thread_id)
+        self.operators = []
+
+    def now_us(self) -> float:
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def add_span(self, name: str, start_us: float, end_us: float):
+        with self._lock:
+            self.spans.append((name, start_us, end_us, threading.get_ident()))
+
+    def breakdown(self) -> dict:
+        """Total milliseconds and call count per span name."""
+        totals = {}
+        for name, start, end, _ in self.spans:
+            entry = totals.setdefault(name, {"ms": 0.0, "calls": 0})
+            entry["ms"] += (end - start) / 1000
+            entry["calls"] += 1
+        for entry in totals.values():
+            entry["ms"] = round(entry["ms"], 3)
+        return totals
+
+    def summary(self) -> dict:
+        return {
+            "request_id": self.request_id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "spans": self.breakdown(),
+            "operators": self.operators,
+        }
+
+
+@contextmanager
+def span(name: str):
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = trace.now_us()
+    try:
+        yield
+    finally:
+        trace.add_span(name, start, trace.now_us())
+
+
+@contextmanager
+def operator_profile():
+    """Collect torch operator timings for the enclosed block when profiling."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    import torch
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    with torch.profiler.profile(activities=activities) as prof:
+        yield
+
+    events = sorted(prof.key_averages(), key=lambda e: e.self_cpu_time_total, reverse=True)
+    trace.operators = [
+        {
+            "name": e.key,
+            "calls": e.count,
+            "self_cpu_ms": round(e.self_cpu_time_total / 1000, 3),
+            "cpu_total_ms": round(e.cpu_time_total / 1000, 3),
+            "cuda_total_ms": round(getattr(e, "cuda_time_total", 0) / 1000, 3),
+        }
+        for e in events[:TOP_OPERATORS]
+    ]
+
+
+class Profiler:
+    """
+    Sampled request profiler armed on demand for the next N requests or X seconds.
+    While disarmed it holds no hooks and `request()` is a single flag check.
+    """
+
+    # Model submodules timed with forward hooks while armed
+    MODULES = {"encoder": "encoder", "decoder": "decoder", "at_model": "tagging_head"}
+
+    def __init__(self):
+        self.armed = False
+        self._lock = threading.Lock()
+        self._busy = False
+        self._remaining = None
+        self._until = None
+        self._model = None
+        self._hooks = []
+        self._timer = None
+        self.traces = deque(maxlen=MAX_TRACES)
+
+    def attach(self, model):
+        self._model = model
+
+    def arm(self, requests: Optional[int] = None, seconds: Optional[float] = None):
+        if requests is None and seconds is None:
+            raise ValueError("Specify a number of requests or a number of seconds")
+        with self._lock:
+            self._remaining = requests
+            self._until = time.monotonic() + seconds if seconds is not None else None
+            if not self.armed:
+                self._install_hooks()
+            self.armed = True
+            self._cancel_timer()
+            if seconds is not None:
+                # Remove the hooks on time even if no request comes in to notice the expiry
+                self._timer = threading.Timer(seconds, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def disarm(self):
+        with self._lock:
+            self._disarm()
+
+    def status(self) -> dict:
+        self._expire()
+        return {
+            "armed": self.armed,
+            "remaining_requests": self._remaining,
+            "remaining_seconds": (
+                round(max(0.0, self._until - time.monotonic()), 1) if self._until is not None else None
+            ),
+            "traces": len(self.traces),
+        }
+
+    def _expire(self):
+        with self._lock:
+            if self._until is None or time.monotonic() < self._until:
+                return
+            if self._busy:
+                # Let the request being profiled finish; _release disarms
+                self._remaining = 0
+            else:
+                self._disarm()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _disarm(self):
+        self.armed = False
+        self._remaining = None
+        self._until = None
+        self._cancel_timer()
+        for handle in self._hooks:
+            handle.remove()
+        self._hooks = []
+
+    def _install_hooks(self):
+        if self._model is None:
+            return
+        import torch
+        sync = torch.cuda.synchronize if self._model.device.type == "cuda" else None
+
+        for attr, label in self.MODULES.items():
+            module = getattr(self._model, attr, None)
+            if module is None:
+                continue
+
+            def pre_hook(mod, args, _label=label):
+                trace = _current_trace.get()
+                if trace is not None:
+                    if sync:
+                        sync()
+                    mod._profile_start = trace.now_us()
+
+            def post_hook(mod, args, output, _label=label):
+                trace = _current_trace.get()
+                start = getattr(mod, "_profile_start", None)
+                if trace is not None and start is not None:
+                    if sync:
+                        sync()
+                    trace.add_span(_label, start, trace.now_us())
+                    mod._profile_start = None
+
+            self._hooks.append(module.register_forward_pre_hook(pre_hook))
+            self._hooks.append(module.register_forward_hook(post_hook))
+
+    def _claim(self) -> bool:
+        with self._lock:
+            if not self.armed or self._busy:
+                return False
+            if self._until is not None and time.monotonic() >= self._until:
+                self._disarm()
+                return False
+            if self._remaining is not None:
+                self._remaining -= 1
+                if self._remaining <= 0:
+                    # Hooks stay until this last request finishes
+                    self._remaining = 0
+            self._busy = True
+            return True
+
+    def _release(self):
+        with self._lock:
+            self._busy = False
+            if self._remaining == 0:
+                self._disarm()
+
+    @contextmanager
+    def request(self, name: str):
+        """Profile the enclosed request if armed and no other request is being profiled."""
+        if not self.armed or not self._claim():
+            yield None
+            return
+
+        trace = RequestTrace(name)
+        token = _current_trace.set(trace)
+        start = trace.now_us()
+        try:
+            yield trace
+        finally:
+            trace.add_span(name, start, trace.now_us())
+            _current_trace.reset(token)
+            self.traces.append(trace)
+            self._release()
+
+    def find(self, request_id: Optional[str] = None) -> list:
+        traces = list(self.traces)
+        if request_id is None:
+            return traces
+        return [t for t in traces if t.request_id == request_id]
+
+
+def to_chrome_trace(traces: list) -> dict:
+    """Chrome trace event format (load in chrome://tracing or Perfetto)."""
+    events = []
+    for pid, trace in enumerate(traces, start=1):
+        events.append({
+            "name": "process_name", "ph": "M", "pid": pid,
+            "args": {"name": f"{trace.name} {trace.request_id}"},
+        })
+        for name, start, end, tid in trace.spans:
+            events.append({
+                "name": name, "cat": trace.name, "ph": "X",
+                "ts": start, "dur": end - start, "pid": pid, "tid": tid,
+            })
+    return {
+        "traceEvents": events,
+        "displayTimeUnit": "ms",
+        "otherData": {"requests": [t.summary() for t in traces]},
+    }
+
+
+def to_speedscope(traces: list) -> dict:
+    """speedscope evented profiles, one per request and thread."""
+    frames, frame_index, profiles = [], {}, []
+    for trace in traces:
+        by_thread = {}
+        for name, start, end, tid in trace.spans:
+            by_thread.setdefault(tid, []).append((name, start, end))
+
+        for tid, spans in by_thread.items():
+            events = []
+            for name, start, end in spans:
+                if name not in frame_index:
+                    frame_index[name] = len(frames)
+                    frames.append({"name": name})
+                events.append({"type": "O", "frame": frame_index[name], "at": start, "_other": end})
+                events.append({"type": "C", "frame": frame_index[name], "at": end, "_other": start})
+            # At equal times closes come before opens; outer spans open first and close last
+            events.sort(key=lambda e: (e["at"], e["type"] == "O", -e["_other"]))
+            for e in events:
+                del e["_other"]
+            profiles.append({
+                "type": "evented",
+                "name": f"{trace.name} {trace.request_id} thread {tid}",
+                "unit": "microseconds",
+                "startValue": min(s for _, s, _ in spans),
+                "endValue": max(e for _, _, e in spans),
+                "events": events,
+            })
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": profiles,
+        "name": "whisper-at requests",
+        "exporter": "whisper-at-server",
+    }
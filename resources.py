@@ -0,0 +1,148 @@
+import os
+import logging
+import tempfile
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # non-POSIX platforms: no worker index claiming
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Thread pool knobs read by BLAS/OpenMP/numba at import time
+THREAD_ENV_VARS = [
+    "OMP_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "NUMEXPR_NUM_THREADS",
+    "NUMBA_NUM_THREADS",
+]
+
+LOCK_DIR = os.path.join(tempfile.gettempdir(), "whisper_at_workers")
+
+# Keeps the claimed worker lock open for the life of the process
+_worker_lock = None
+
+
+def available_cores() -> List[int]:
+    """Cores this process may run on (respects cgroup/taskset restrictions)."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def claim_worker_index(workers: int) -> int:
+    """
+    Claim a stable index in [0, workers) for this worker process. uvicorn does not
+    tell workers who they are, so each one grabs the first free lock file. Locks are
+    released by the OS when a worker dies, so a restarted worker reuses its slot.
+    """
+    global _worker_lock
+    if fcntl is None or workers <= 1:
+        return 0
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    for index in range(workers):
+        fd = os.open(os.path.join(LOCK_DIR, f"worker-{index}.lock"), os.O_CREAT | os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        _worker_lock = fd
+        return index
+    logger.warning("All worker indexes are taken; sharing cores with worker 0")
+    return 0
+
+
+class ResourcePlan:
+    """Core layout for one worker process."""
+
+    def __init__(self, workers: int, worker_index: int, cores: List[int],
+                 total_cores: int, pin: bool, interop_threads: int = 1):
+        self.workers = workers
+        self.worker_index = worker_index
+        self.cores = cores
+        self.total_cores = total_cores
+        self.pin = pin
+        # One model, one inference at a time per worker: it gets the whole share
+        self.intra_op_threads = max(1, len(cores))
+        self.interop_threads = interop_threads
+        # Thread counts torch actually uses, set by apply_torch_threads
+        self.applied_intra_op_threads = None
+        self.applied_interop_threads = None
+
+    def as_dict(self) -> dict:
+        return {
+            "workers": self.workers,
+            "worker_index": self.worker_index,
+            "total_cores": self.total_cores,
+            "cores": self.cores,
+            "pinned": self.pin,
+            "planned_intra_op_threads": self.intra_op_threads,
+            "intra_op_threads": self.applied_intra_op_threads or self.intra_op_threads,
+            "interop_threads": self.applied_interop_threads or self.interop_threads,
+        }
+
+
+def plan_resources(workers: int, worker_index: int = 0,
+                   cores: Optional[List[int]] = None, pin: bool = False,
+                   threads: Optional[int] = None) -> ResourcePlan:
+    """
+    Split the available cores evenly among workers. Leftover cores go to the lowest
+    worker indexes. `threads` overrides the per-worker thread count (used by the
+    benchmark sweep).
+    """
+    cores = cores if cores is not None else available_cores()
+    workers = max(1, workers)
+
+    if len(cores) >= workers:
+        share, extra = divmod(len(cores), workers)
+        start = worker_index * share + min(worker_index, extra)
+        mine = cores[start:start + share + (1 if worker_index < extra else 0)]
+    else:
+        # More workers than cores: overlap, one core each
+        mine = [cores[worker_index % len(cores)]]
+
+    plan = ResourcePlan(workers, worker_index, mine, len(cores), pin)
+    if threads is not None:
+        plan.intra_op_threads = max(1, threads)
+    return plan
+
+
+def apply_thread_env(plan: ResourcePlan):
+    """Size BLAS/OpenMP pools. Must run before numpy/torch/librosa are imported."""
+    for var in THREAD_ENV_VARS:
+        os.environ.setdefault(var, str(plan.intra_op_threads))
+    if plan.pin and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, plan.cores)
+
+
+def apply_torch_threads(plan: ResourcePlan):
+    """Size torch's intra-op and inter-op pools and cap any BLAS pool already loaded."""
+    import torch
+
+    # A preset OMP_NUM_THREADS wins over the plan (apply_thread_env only sets defaults)
+    threads = int(os.environ.get("OMP_NUM_THREADS", plan.intra_op_threads))
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(plan.interop_threads)
+    except RuntimeError:
+        # Already set, or parallel work already started in this process
+        pass
+
+    try:
+        from threadpoolctl import threadpool_limits
+        threadpool_limits(limits=threads)
+    except ImportError:
+        pass
+
+    plan.applied_intra_op_threads = torch.get_num_threads()
+    plan.applied_interop_threads = torch.get_num_interop_threads()
+
+
+def plan_from_env() -> ResourcePlan:
+    """Build this worker's plan from WORKERS and CPU_AFFINITY."""
+    workers = int(os.getenv("WORKERS", "1"))
+    pin = os.getenv("CPU_AFFINITY", "0").lower() in ("1", "true", "yes")
+    return plan_resources(workers, claim_worker_index(workers), pin=pin)
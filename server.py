@@ -1,19 +1,34 @@
 import os
-import tempfile
 import logging
 import sys
+import asyncio
 from typing import Optional
 
+# Partition cores before numpy/torch/librosa size their thread pools on import
+import resources
+RESOURCE_PLAN = resources.plan_from_env()
+resources.apply_thread_env(RESOURCE_PLAN)
+
 import whisper_at as whisper
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, Form, HTTPException, Request, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
-import librosa
-import soundfile as sf
+from starlette.requests import ClientDisconnect
 import uvicorn
 import numpy as np
 from contextlib import asynccontextmanager
 from utils import post_process_response_data
+from audio_io import preprocess_audio, raw_codec
+from upload_stream import UploadLimits, UploadRejected, decode_file, receive_multipart
+from cancellation import (
+    CancelToken, CancellationStats, InferenceCancelled, REASON_DISCONNECTED,
+    REASON_EXPIRED, bind_token, install_window_hook, parse_timeout,
+)
+from decoding_profiles import PROFILES, get_profile, install_repetition_guard, use_profile
+from tagging import TagAccumulator, TagBatcher, encode_windows, mel_windows, parse_time_resolutions
+from profiling import Profiler, span, operator_profile, to_chrome_trace, to_speedscope
 import socket
+import secrets
 
 # Configure logging to file and console
 logging.basicConfig(
@@ -52,11 +67,49 @@ sys.modules['builtins'].print = custom_print
 MODEL_NAME = "medium.en"
 model = None
 
+# Upload formats identified by extension; raw telephony payloads go by content type
+AUDIO_EXTENSIONS = [".mp3", ".wav", ".m4a", ".flac", ".ogg"]
+
+# Uploads are streamed and rejected as soon as they cross either limit (unset = no limit)
+MAX_UPLOAD_MB = os.getenv("MAX_UPLOAD_MB", "100")
+MAX_AUDIO_SECONDS = os.getenv("MAX_AUDIO_SECONDS", "3600")
+UPLOAD_LIMITS = UploadLimits(
+    max_bytes=int(float(MAX_UPLOAD_MB) * 1024 * 1024) if MAX_UPLOAD_MB else None,
+    max_seconds=float(MAX_AUDIO_SECONDS) if MAX_AUDIO_SECONDS else None,
+)
+
+# Audio tag filtering shared by /transcribe/ and /tag
+AT_PARSE_OPTIONS = dict(language='en', top_k=1, p_threshold=-3, include_class_list=list(range(527)))
+
+# Cross-request batching of encoder passes for /tag
+TAG_MAX_BATCH = int(os.getenv("TAG_MAX_BATCH", "8"))  # 30-second windows per encoder pass
+TAG_BATCH_WAIT = float(os.getenv("TAG_BATCH_WAIT_MS", "10")) / 1000
+
+# Decoding profile used when a request does not name one
+DEFAULT_DECODING_PROFILE = os.getenv("DEFAULT_DECODING_PROFILE", "balanced")
+
+# Inference lock and cancellation settings
+DEFAULT_REQUEST_TIMEOUT = os.getenv("DEFAULT_REQUEST_TIMEOUT")  # seconds, unset = no deadline
+DEADLINE_HEADER = "X-Request-Timeout"
+DISCONNECT_POLL_INTERVAL = 0.25
+# whisper_at's kv-cache hooks live on the shared model.decoder, so concurrent
+# transcribe calls on one model corrupt each other: each worker runs one at a time
+inference_lock = asyncio.Lock()
+cancellation_stats = CancellationStats()
+
+# On-demand profiling; admin endpoints are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_HEADER = "X-Admin-Token"
+profiler = Profiler()
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     global model
+    resources.apply_torch_threads(RESOURCE_PLAN)
+    logger.info(f"Resource plan: {RESOURCE_PLAN.as_dict()}")
     logger.info(f"Loading Whisper-AT model: {MODEL_NAME}")
-    model = whisper.load_model(MODEL_NAME)
+    model = install_window_hook(install_repetition_guard(whisper.load_model(MODEL_NAME)))
+    profiler.attach(model)
     logger.info("Model loaded successfully")
     yield
     logger.info("Shutting down application")
@@ -69,123 +122,367 @@ app = FastAPI(
     lifespan=lifespan
 )
 
-def process_audio(file_path: str) -> tuple:
+def process_audio(audio_data: np.ndarray, sample_rate: int) -> np.ndarray:
     """
     Normalize, denoise, pad, and resample audio to 16kHz if needed.
-    Returns: (processed_file_path, is_temp_file)
+    Returns: float32 samples at 16kHz, passed to model.transcribe as an array
     """
     try:
-        def normalize_audio(audio):
-            peak = np.max(np.abs(audio))
-            return audio / peak if peak > 0 else audio
-
-        def apply_noise_gate(audio, threshold=0.015):
-            return np.where(np.abs(audio) < threshold, 0, audio)
-
-        # Load with original sampling rate
-        audio_data, sample_rate = librosa.load(file_path, sr=None)
-        logger.info(f"Original audio sampling rate: {sample_rate} Hz")
-
-        # Normalize
-        audio_data = normalize_audio(audio_data)
-
-        # Denoise with noise gate
-        audio_data = apply_noise_gate(audio_data)
-
-        # Pad 1 second silence at start and end
-        pad_samples = int(sample_rate * 1)
-        silence = np.zeros(pad_samples)
-        audio_data = np.concatenate([silence, audio_data, silence])
-
-        # Resample if needed
-        target_sr = 16000
-        if sample_rate != target_sr:
-            logger.info("Resampling to 16000 Hz...")
-            audio_data = librosa.resample(audio_data, orig_sr=sample_rate, target_sr=target_sr)
-            sample_rate = target_sr
-
-        # Save to temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as temp_file:
-            temp_file_path = temp_file.name
-        sf.write(temp_file_path, audio_data, sample_rate)
-        return temp_file_path, True
+        return preprocess_audio(audio_data, sample_rate)
 
     except Exception as e:
         logger.error(f"Error processing audio: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
 
-@app.post("/transcribe/", response_class=JSONResponse)
-async def transcribe_audio(
-    file: UploadFile = File(...),
-    audio_tagging_time_resolution: Optional[int] = Form(4.0),
-    temperature: Optional[float] = Form(0.01),
-    no_speech_threshold: Optional[float] = Form(0.4)
-):
-    if not file:
-        raise HTTPException(status_code=400, detail="No file provided")
-
-    allowed_extensions = [".mp3", ".wav", ".m4a", ".flac", ".ogg"]
-    file_ext = os.path.splitext(file.filename)[1].lower()
-    if file_ext not in allowed_extensions:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Unsupported file format. Supported formats: {', '.join(allowed_extensions)}"
-        )
+async def watch_request(request: Request, token: CancelToken):
+    """Flag the token when the client disconnects or the deadline passes."""
+    while not token.cancelled:
+        if await request.is_disconnected():
+            token.cancel(REASON_DISCONNECTED)
+            break
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
 
-    # Save uploaded file
-    temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=file_ext)
-    temp_file_path = temp_file.name
-    temp_file.close()
+async def run_guarded(request: Request, token: CancelToken, func, *args):
+    """
+    Run blocking inference in a worker thread once the model is free.
+    Queued work is dropped as soon as the caller goes away; running work is
+    aborted at the next 30-second window boundary.
+    """
+    watcher = asyncio.create_task(watch_request(request, token))
+    acquire = asyncio.create_task(inference_lock.acquire())
+    try:
+        with span("queue_wait"):
+            await asyncio.wait({acquire, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not acquire.done() or token.cancelled:
+            acquire.cancel()
+            if acquire.done() and not acquire.cancelled():
+                inference_lock.release()
+            cancellation_stats.record(token.reason, running=False)
+            raise InferenceCancelled(token.reason)
+
+        started = False
+
+        def job():
+            nonlocal started
+            with bind_token(token):
+                token.check()
+                started = True
+                return func(*args)
+
+        try:
+            return await run_in_threadpool(job)
+        except InferenceCancelled as e:
+            cancellation_stats.record(e.reason, running=started)
+            raise
+        finally:
+            inference_lock.release()
+    finally:
+        watcher.cancel()
+
+def cancelled_exception(e: InferenceCancelled) -> HTTPException:
+    if e.reason == REASON_EXPIRED:
+        return HTTPException(status_code=504, detail="Request deadline expired before transcription finished")
+    # 499: client closed request; nobody is listening, but keep the log honest
+    return HTTPException(status_code=499, detail="Client disconnected")
+
+def check_upload_format(filename: str, content_type: Optional[str]):
+    """Validate the upload format from the file part headers, before any audio arrives."""
+    file_ext = os.path.splitext(filename or "")[1].lower()
+    if raw_codec(content_type) is None and file_ext not in AUDIO_EXTENSIONS:
+        raise UploadRejected(
+            400,
+            f"Unsupported file format. Supported formats: {', '.join(AUDIO_EXTENSIONS)}"
+        )
 
+async def receive_upload(request: Request) -> tuple:
+    """
+    Stream the multipart body, decoding the audio part as it arrives.
+    Returns (form fields, sink); the caller must close the sink.
+    """
+    try:
+        return await receive_multipart(request, UPLOAD_LIMITS, check_upload_format)
+    except ClientDisconnect:
+        logger.warning("Client disconnected during upload")
+        cancellation_stats.record(REASON_DISCONNECTED, running=False)
+        raise cancelled_exception(InferenceCancelled(REASON_DISCONNECTED))
+    except UploadRejected as e:
+        logger.warning(f"Upload rejected: {e.detail}")
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+
+def form_value(fields: dict, name: str, convert, default=None):
+    """Typed form field from a streamed upload; 400 when it does not parse."""
+    value = fields.get(name)
+    if value is None or value == "":
+        return default
     try:
-        with open(temp_file_path, "wb") as f:
-            f.write(await file.read())
-
-        # Process audio
-        processed_file_path, is_processed_temp = process_audio(temp_file_path)
-    
-        # Transcribe
-        logger.info("Starting transcription...")
+        return convert(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid value for {name}: {value!r}")
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise ValueError(f"{value} is not positive")
+    return number
+
+def upload_form_schema(fields: dict) -> dict:
+    """OpenAPI request body for endpoints that parse their multipart body themselves."""
+    properties = {"file": {"type": "string", "format": "binary"}}
+    properties.update(fields)
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"multipart/form-data": {"schema": {
+                "type": "object", "required": ["file"], "properties": properties,
+            }}},
+        }
+    }
+
+def load_upload(upload: dict) -> np.ndarray:
+    """Finish decoding a streamed upload and preprocess it into 16kHz float32 samples."""
+    with span("decode_audio"):
+        sink = upload["sink"]
+        sink.set_sample_rate(upload["sample_rate"])
+        try:
+            audio_data, sample_rate = sink.decode()
+        except UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail)
+        except (ValueError, RuntimeError) as e:
+            raise HTTPException(status_code=400, detail=f"Invalid audio payload: {str(e)}")
+    with span("process_audio"):
+        return process_audio(audio_data, sample_rate)
+
+def run_transcription(upload: dict, audio_tagging_time_resolution, no_speech_threshold,
+                      profile, decoding_options: dict) -> dict:
+    audio_data = load_upload(upload)
+
+    logger.info("Starting transcription...")
+    logger.info(f"Decoding profile: {profile.name}")
+    with span("model.transcribe"), operator_profile(), use_profile(profile):
         result = model.transcribe(
-            processed_file_path,
+            audio_data,
             at_time_res=audio_tagging_time_resolution,
-            temperature=0.0,
             no_speech_threshold=no_speech_threshold,
+            **decoding_options,
         )
 
-        audio_tag_result = whisper.parse_at_label(
-            result,
-            language='en',
-            top_k=1,
-            p_threshold=-3,
-            include_class_list=list(range(527))
-        )
+    with span("parse_at_label"):
+        audio_tag_result = whisper.parse_at_label(result, **AT_PARSE_OPTIONS)
+
+    return {
+        "text": result.get('text', ''),
+        "segments": result.get("segments", []),
+        "audio_tags": audio_tag_result,
+    }
+
+@app.post("/transcribe/", response_class=JSONResponse, openapi_extra=upload_form_schema({
+    "audio_tagging_time_resolution": {"type": "integer", "default": 4},
+    "temperature": {"type": "number"},
+    "no_speech_threshold": {"type": "number", "default": 0.4},
+    "deadline_seconds": {"type": "number"},
+    "decoding_profile": {"type": "string", "enum": list(PROFILES)},
+    "sample_rate": {"type": "integer"},
+}))
+async def transcribe_audio(request: Request):
+    """
+    Form fields: file, audio_tagging_time_resolution (4), temperature, no_speech_threshold (0.4),
+    deadline_seconds, decoding_profile, sample_rate. The body is parsed here rather than
+    through File()/Form() so the audio can be checked and decoded while it uploads.
+    """
+    # The deadline covers the upload as well
+    try:
+        header_timeout = parse_timeout(request.headers.get(DEADLINE_HEADER), DEFAULT_REQUEST_TIMEOUT)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    token = CancelToken.from_timeout(header_timeout)
 
-        text = result.get('text', '')
-        hostname = socket.gethostname()
-        response_data = {
-            "text": text,
-            "segments": result.get("segments", []),
-            "audio_tags": audio_tag_result,
-            "hostname":hostname,
-        }
-        results_response = post_process_response_data(response_data)
+    sink = None
+    try:
+        with profiler.request("transcribe"):
+            with span("upload"):
+                fields, sink = await receive_upload(request)
+
+            audio_tagging_time_resolution = form_value(fields, "audio_tagging_time_resolution", int, 4)
+            temperature = form_value(fields, "temperature", float)
+            no_speech_threshold = form_value(fields, "no_speech_threshold", float, 0.4)
+            deadline_seconds = form_value(fields, "deadline_seconds", float)
+            sample_rate = form_value(fields, "sample_rate", positive_int)
+
+            # Only known once the body has arrived; the header deadline keeps counting from the start
+            try:
+                token.tighten(parse_timeout(deadline_seconds))
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+            try:
+                profile = get_profile(fields.get("decoding_profile") or DEFAULT_DECODING_PROFILE)
+                decoding_options = profile.transcribe_options(temperature)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+
+            upload = {"sink": sink, "sample_rate": sample_rate}
+            response_data = await run_guarded(
+                request, token, run_transcription,
+                upload, audio_tagging_time_resolution, no_speech_threshold,
+                profile, decoding_options,
+            )
+            response_data["hostname"] = socket.gethostname()
+            with span("post_process_response_data"):
+                results_response = post_process_response_data(response_data)
         return JSONResponse(content=results_response)
 
+    except InferenceCancelled as e:
+        logger.warning(f"Transcription abandoned: {e.reason}")
+        raise cancelled_exception(e)
+
+    except HTTPException:
+        raise
+
     except Exception as e:
         logger.error(f"Error during transcription: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error during transcription: {str(e)}")
 
     finally:
-        if os.path.exists(temp_file_path):
-            os.unlink(temp_file_path)
-        if 'processed_file_path' in locals() and is_processed_temp and os.path.exists(processed_file_path):
-            os.unlink(processed_file_path)
+        if sink is not None:
+            sink.close()
+
+async def encode_tag_batch(windows):
+    async with inference_lock:
+        return await run_in_threadpool(encode_windows, model, windows, TAG_MAX_BATCH)
+
+tag_batcher = TagBatcher(encode_tag_batch, max_batch=TAG_MAX_BATCH, max_wait=TAG_BATCH_WAIT)
+
+def prepare_tagging(upload: dict) -> tuple:
+    audio_data = load_upload(upload)
+    with span("log_mel_spectrogram"):
+        return mel_windows(audio_data)
+
+@app.post("/tag", response_class=JSONResponse, openapi_extra=upload_form_schema({
+    "time_resolutions": {"type": "string", "default": "4"},
+    "sample_rate": {"type": "integer"},
+}))
+async def tag_audio(request: Request):
+    """
+    Audio tags only: one encoder pass (batched with concurrent /tag requests) and
+    the tagging head evaluated at every requested time resolution, no decoding.
+    Form fields: file, time_resolutions ("4"), sample_rate.
+    """
+    sink = None
+    try:
+        with profiler.request("tag"):
+            with span("upload"):
+                fields, sink = await receive_upload(request)
+
+            try:
+                resolutions = parse_time_resolutions(fields.get("time_resolutions") or "4")
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            upload = {"sink": sink, "sample_rate": form_value(fields, "sample_rate", positive_int)}
+
+            windows, content_frames = await run_in_threadpool(prepare_tagging, upload)
+            tags = TagAccumulator(model, content_frames, len(windows), resolutions)
+            # One encoder batch of features at a time, each dropped once the head has run on it
+            for batch in windows.split(TAG_MAX_BATCH):
+                with span("encoder_batch"):
+                    features = await tag_batcher.submit(batch)
+                with span("tagging_head"):
+                    await run_in_threadpool(tags.add, features)
+                del features
+            logits = tags.result()
+
+            with span("parse_at_label"):
+                audio_tags = {
+                    f"{resolution:g}": whisper.parse_at_label(
+                        {"language": "en", "at_time_res": resolution, "audio_tag": tags},
+                        **AT_PARSE_OPTIONS
+                    )
+                    for resolution, tags in logits.items()
+                }
+        return JSONResponse(content={"audio_tags": audio_tags, "hostname": socket.gethostname()})
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        logger.error(f"Error during tagging: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error during tagging: {str(e)}")
+
+    finally:
+        if sink is not None:
+            sink.close()
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to Whisper-AT Transcription API. Use /transcribe/ endpoint to transcribe audio files."}
 
+@app.get("/decoding-profiles")
+async def decoding_profiles():
+    return {
+        "default": DEFAULT_DECODING_PROFILE,
+        "profiles": {name: profile.as_dict() for name, profile in PROFILES.items()},
+    }
+
+@app.get("/metrics")
+async def metrics():
+    return {
+        "cancellation": cancellation_stats.snapshot(),
+        "resources": RESOURCE_PLAN.as_dict(),
+    }
+
+def require_admin(request: Request):
+    supplied = request.headers.get(ADMIN_HEADER, "")
+    if not ADMIN_TOKEN or not secrets.compare_digest(supplied, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.post("/admin/profile")
+async def start_profiling(
+    request: Request,
+    requests: Optional[int] = Form(None),
+    seconds: Optional[float] = Form(None)
+):
+    """Profile the next `requests` /transcribe/ or /tag requests, or all such requests for `seconds`."""
+    require_admin(request)
+    if (requests is not None and requests < 1) or (seconds is not None and seconds <= 0):
+        raise HTTPException(status_code=400, detail="requests and seconds must be positive")
+    try:
+        profiler.arm(requests=requests, seconds=seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return profiler.status()
+
+@app.delete("/admin/profile")
+async def stop_profiling(request: Request):
+    require_admin(request)
+    profiler.disarm()
+    return profiler.status()
+
+@app.get("/admin/profile")
+async def profiling_status(request: Request):
+    """Profiler state plus the per-request span breakdown of collected traces."""
+    require_admin(request)
+    return {
+        **profiler.status(),
+        "requests": [trace.summary() for trace in profiler.find()],
+    }
+
+@app.get("/admin/profile/trace")
+async def download_trace(
+    request: Request,
+    format: str = Query("chrome", pattern="^(chrome|speedscope)$"),
+    request_id: Optional[str] = None
+):
+    require_admin(request)
+    traces = profiler.find(request_id)
+    if not traces:
+        raise HTTPException(status_code=404, detail="No profiled requests collected")
+
+    content = to_chrome_trace(traces) if format == "chrome" else to_speedscope(traces)
+    filename = f"whisper-at-{request_id or 'traces'}.{format}.json"
+    return JSONResponse(
+        content=content,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
 @app.get("/health")
 async def health_check():
     try:
@@ -193,21 +490,23 @@ async def health_check():
         if not os.path.exists(test_file_path):
             raise FileNotFoundError("Test file not found")
 
-        processed_file_path, is_temp = process_audio(test_file_path)
-        result = model.transcribe(
-            processed_file_path,
-            at_time_res=10,
-            temperature=0.01,
-            no_speech_threshold=0.4
-        )
+        def run_health_transcription():
+            audio_data = process_audio(*decode_file(test_file_path))
+            return model.transcribe(
+                audio_data,
+                at_time_res=10,
+                temperature=0.01,
+                no_speech_threshold=0.4
+            )
+
+        # Wait for the model like any request; concurrent decodes corrupt each other
+        async with inference_lock:
+            result = await run_in_threadpool(run_health_transcription)
 
         text = result.get("text", "").strip().lower()
         if not text or len(text) < 2:
             raise ValueError("Transcription too short or empty")
 
-        if is_temp and os.path.exists(processed_file_path):
-            os.unlink(processed_file_path)
-
         return {"status": "ok", "text": text}
 
     except Exception as e:
@@ -172,7 +172,7 @@ async def transcribe_audio(
         result = model.transcribe(
             processed_file_path, 
             at_time_res=audio_tagging_time_resolution,
-            temperature=0.01,
+            temperature=temperature,
             no_speech_threshold=0.6, 
         )
 
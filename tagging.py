@@ -0,0 +1,195 @@
+import math
+import asyncio
+import contextvars
+from typing import List
+
+import torch
+import torch.nn.functional as F
+import whisper_at as whisper
+from whisper_at.audio import N_FRAMES, N_SAMPLES
+
+# Mel frames per pooled encoder step: 2x conv stride * 20x pooling in AudioEncoder
+FRAMES_PER_POOLED_STEP = 40
+# Pooled steps per 30-second window
+STEPS_PER_WINDOW = N_FRAMES // FRAMES_PER_POOLED_STEP
+# Pooled steps fed to the tagging head per call, ~5 minutes of audio
+TAG_CHUNK_STEPS = 750
+
+
+def parse_time_resolutions(value: str) -> List[float]:
+    """Parse '4,10' into [4.0, 10.0]; each must be a positive multiple of 0.4 s."""
+    resolutions = []
+    for part in value.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            resolution = float(part)
+        except ValueError:
+            raise ValueError(f"Invalid time resolution: {part!r}")
+        if resolution <= 0 or round(resolution * 100) % FRAMES_PER_POOLED_STEP != 0:
+            raise ValueError(f"Time resolution must be a positive multiple of 0.4 seconds, got {part}")
+        resolutions.append(resolution)
+    if not resolutions:
+        raise ValueError("At least one time resolution is required")
+    return resolutions
+
+
+def mel_windows(audio) -> tuple:
+    """
+    Split 16 kHz audio into 30-second mel windows: ([n, 80, 3000], content_frames).
+    Like model.transcribe, the audio (not the mel) is padded with 30 s of silence.
+    """
+    mel = whisper.log_mel_spectrogram(audio, padding=N_SAMPLES)
+    content_frames = mel.shape[-1] - N_FRAMES
+    n_windows = max(1, math.ceil(content_frames / N_FRAMES))
+    windows = torch.stack([
+        whisper.pad_or_trim(mel[:, i * N_FRAMES:(i + 1) * N_FRAMES], N_FRAMES)
+        for i in range(n_windows)
+    ])
+    return windows, content_frames
+
+
+@torch.no_grad()
+def pooled_layer_features(model, mel: torch.Tensor) -> torch.Tensor:
+    """
+    Run the audio encoder and return the pooled per-layer representations the tagging
+    head consumes, for every item in the batch: [batch, n_layer, 75, n_state].
+    AudioEncoder.forward only keeps these for the first batch item, so the block loop
+    is repeated here; ln_post is skipped since only the decoder needs it.
+    """
+    encoder = model.encoder
+    x = F.gelu(encoder.conv1(mel))
+    x = F.gelu(encoder.conv2(x))
+    x = x.permute(0, 2, 1)
+    x = (x + encoder.positional_embedding).to(x.dtype)
+
+    pooled = []
+    for block in encoder.blocks:
+        x = block(x)
+        pooled.append(F.avg_pool2d(x, kernel_size=(20, 1), stride=(20, 1)))
+    return torch.stack(pooled, dim=1)
+
+
+@torch.no_grad()
+def encode_windows(model, windows: torch.Tensor, batch_size: int) -> torch.Tensor:
+    dtype = torch.float16 if model.device.type == "cuda" else torch.float32
+    features = [
+        pooled_layer_features(model, chunk.to(model.device).to(dtype))
+        for chunk in windows.split(batch_size)
+    ]
+    return torch.cat(features)
+
+
+class TagAccumulator:
+    """
+    Runs the tagging head over encoder features batch by batch as they are encoded,
+    so only one batch of per-layer features is alive at a time. Features left over
+    from a batch that do not fill a decision window are carried into the next one.
+
+    result() returns {resolution: [num_segments, 527]}, the same shape as
+    model.transcribe's audio_tag. Like transcribe, a last partial segment is filled
+    with the encoded silence padding of its window rather than zeros. Values are
+    identical when the resolution divides 30 s; otherwise transcribe realigns each
+    window by dropping features, which shifts its later segments, while here the
+    encoder output is treated as one continuous timeline.
+    """
+
+    def __init__(self, model, content_frames: int, n_windows: int, time_resolutions: List[float]):
+        self.model = model
+        n_steps = math.ceil(content_frames / FRAMES_PER_POOLED_STEP)
+        available = n_windows * STEPS_PER_WINDOW
+        self._windows = {}
+        self._targets = {}
+        for resolution in time_resolutions:
+            decision_window = int(resolution * 2.5)
+            self._windows[resolution] = decision_window
+            self._targets[resolution] = min(available, math.ceil(n_steps / decision_window) * decision_window)
+        self._consumed = dict.fromkeys(time_resolutions, 0)
+        self._pending = dict.fromkeys(time_resolutions)
+        self._logits = {resolution: [] for resolution in time_resolutions}
+
+    @torch.no_grad()
+    def add(self, features: torch.Tensor):
+        """Feed the next [batch, n_layer, 75, n_state] encoder features in timeline order."""
+        batch, n_layer, steps, n_state = features.shape
+        rep = features.permute(1, 0, 2, 3).reshape(n_layer, batch * steps, n_state)
+
+        for resolution, decision_window in self._windows.items():
+            take = rep[:, :self._targets[resolution] - self._consumed[resolution]]
+            self._consumed[resolution] += take.shape[1]
+            pending = self._pending[resolution]
+            pending = take if pending is None else torch.cat([pending, take], dim=1)
+
+            usable = pending.shape[1] - pending.shape[1] % decision_window
+            if self._consumed[resolution] == self._targets[resolution]:
+                # Last batch: only reached when every window is full, ATModel zero-pads the rest
+                usable = pending.shape[1]
+            # Segments are independent, so chunking on decision-window boundaries is exact
+            chunk = decision_window * max(1, TAG_CHUNK_STEPS // decision_window)
+            for start in range(0, usable, chunk):
+                logits = self.model.at_model(pending[:, start:min(start + chunk, usable)], time_resolution=resolution)
+                self._logits[resolution].append(logits.float().cpu())
+            # Copy the remainder so the batch's features can be freed
+            self._pending[resolution] = pending[:, usable:].clone() if usable < pending.shape[1] else None
+
+    def result(self) -> dict:
+        return {resolution: torch.cat(logits) for resolution, logits in self._logits.items()}
+
+
+class TagBatcher:
+    """
+    Collects mel windows from concurrent /tag requests and runs them through the
+    encoder together. `encode` is an async callable mapping a [n, 80, 3000] tensor to
+    per-window features; each request gets its own slice of the result back.
+    """
+
+    def __init__(self, encode, max_batch: int = 8, max_wait: float = 0.01):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._pending = []
+        self._task = None
+
+    async def submit(self, windows: torch.Tensor) -> torch.Tensor:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((windows, future))
+        if self._task is None or self._task.done():
+            # Start from an empty context so the shared batches are not attributed to
+            # whichever request (e.g. a profiled one) happened to start the drain
+            self._task = contextvars.Context().run(asyncio.create_task, self._drain())
+        return await future
+
+    def _next_batch(self) -> list:
+        batch, size = [], 0
+        while self._pending:
+            windows, future = self._pending[0]
+            if batch and size + len(windows) > self.max_batch:
+                break
+            self._pending.pop(0)
+            if future.done():  # caller went away while queued
+                continue
+            batch.append((windows, future))
+            size += len(windows)
+        return batch
+
+    async def _drain(self):
+        while self._pending:
+            # Give concurrent requests a moment to join the batch
+            await asyncio.sleep(self.max_wait)
+            batch = self._next_batch()
+            if not batch:
+                continue
+            try:
+                features = await self.encode(torch.cat([windows for windows, _ in batch]))
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            offset = 0
+            for windows, future in batch:
+                if not future.done():
+                    future.set_result(features[offset:offset + len(windows)])
+                offset += len(windows)
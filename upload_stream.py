@@ -0,0 +1,473 @@
+import os
+import struct
+import logging
+import tempfile
+from typing import Callable, Optional
+
+import librosa
+import numpy as np
+
+try:
+    from python_multipart import MultipartParser
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart import MultipartParser
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import parse_options_header
+
+from audio_io import decode_raw, raw_codec, raw_format, read_container, sniff_container
+
+logger = logging.getLogger(__name__)
+
+# Bytes sniff_container needs to recognise a container
+SNIFF_BYTES = 12
+# A WAV header (everything before the 'data' chunk) larger than this is treated as corrupt
+MAX_WAV_HEADER_BYTES = 1 << 20
+# Non-file form fields are tiny; cap them so they cannot be used to buffer the body
+MAX_FIELD_BYTES = 64 * 1024
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_ALAW = 6
+WAVE_FORMAT_MULAW = 7
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+class UploadRejected(ValueError):
+    """Upload refused while streaming; status_code is the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class UploadLimits:
+    def __init__(self, max_bytes: Optional[int] = None, max_seconds: Optional[float] = None):
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+
+
+class AudioSink:
+    """
+    Receives the bytes of the uploaded file part as they arrive, enforcing the size
+    and duration limits as early as the format allows. decode() runs after the body
+    is complete (in a worker thread) and returns (mono float32 samples, sample_rate).
+    """
+
+    def __init__(self, limits: UploadLimits):
+        self.limits = limits
+        self.bytes_received = 0
+
+    def write(self, chunk: bytes):
+        self.bytes_received += len(chunk)
+        if self.limits.max_bytes is not None and self.bytes_received > self.limits.max_bytes:
+            raise UploadRejected(413, f"Upload exceeds the {self.limits.max_bytes} byte limit")
+        self._write(chunk)
+
+    def _write(self, chunk: bytes):
+        raise NotImplementedError
+
+    def end(self):
+        """Called when the file part is complete."""
+
+    def set_sample_rate(self, sample_rate: Optional[int]):
+        """Sample rate declared in a form field; only meaningful for raw payloads."""
+
+    def check_duration(self, seconds: float):
+        if self.limits.max_seconds is not None and seconds > self.limits.max_seconds:
+            raise UploadRejected(413, f"Audio is {seconds:.1f} s long; the limit is {self.limits.max_seconds:g} s")
+
+    def decode(self) -> tuple:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class StreamingSink(AudioSink):
+    """Sink that decodes each chunk to float32 as it arrives."""
+
+    def __init__(self, limits: UploadLimits):
+        super().__init__(limits)
+        self.sample_rate = None
+        self._blocks = []
+        self._samples = 0
+
+    def _append(self, samples: np.ndarray):
+        if len(samples):
+            self._blocks.append(samples)
+            self._samples += len(samples)
+            if self.sample_rate:
+                self.check_duration(self._samples / self.sample_rate)
+
+    def decode(self) -> tuple:
+        audio = np.concatenate(self._blocks) if self._blocks else np.zeros(0, dtype=np.float32)
+        self.check_duration(len(audio) / self.sample_rate)
+        return audio, self.sample_rate
+
+
+class RawSink(StreamingSink):
+    """Headerless L16 / mu-law / A-law payload, decoded chunk by chunk."""
+
+    def __init__(self, limits: UploadLimits, content_type: str):
+        super().__init__(limits)
+        try:
+            self.codec, self.sample_rate, self.byte_order = raw_format(content_type)
+        except ValueError as e:
+            raise UploadRejected(400, str(e))
+        self._carry = b""
+
+    def _write(self, chunk: bytes):
+        if self.codec == "l16":
+            chunk = self._carry + chunk
+            usable = len(chunk) - len(chunk) % 2
+            self._carry = chunk[usable:]
+            chunk = chunk[:usable]
+        self._append(decode_raw(chunk, self.codec, self.byte_order))
+
+    def end(self):
+        if self._carry:
+            raise UploadRejected(400, "L16 payload has an odd number of bytes")
+
+    def set_sample_rate(self, sample_rate: Optional[int]):
+        if sample_rate:
+            self.sample_rate = sample_rate
+
+    def decode(self) -> tuple:
+        if not self.sample_rate:
+            raise UploadRejected(400, "Raw L16 payloads need a sample rate (content type 'rate' parameter or sample_rate field)")
+        return super().decode()
+
+
+class SpoolSink(AudioSink):
+    """
+    Formats that cannot be decoded incrementally are spooled to a temp file in chunks,
+    so the upload is never held in memory, and decoded from disk afterwards.
+    FLAC declares its length in STREAMINFO, which is checked before the body arrives.
+    """
+
+    def __init__(self, limits: UploadLimits, kind: str):
+        super().__init__(limits)
+        self.kind = kind
+        self._head = b""
+        self._streaminfo_checked = kind != "flac"
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".wav" if kind == "rifx" else f".{kind}")
+        self.path = temp_file.name
+        self._file = temp_file
+
+    def _write(self, chunk: bytes):
+        if not self._streaminfo_checked:
+            self._head += chunk
+            if len(self._head) >= 42:
+                self._check_streaminfo(self._head)
+                self._streaminfo_checked = True
+                self._head = b""
+        self._file.write(chunk)
+
+    def _check_streaminfo(self, head: bytes):
+        # 'fLaC', 4-byte metadata block header (type 0 = STREAMINFO), then 34 bytes of STREAMINFO
+        if head[4] & 0x7F != 0:
+            raise UploadRejected(400, "Corrupt FLAC header: first metadata block is not STREAMINFO")
+        packed = struct.unpack(">Q", head[18:26])[0]
+        sample_rate = packed >> 44
+        total_samples = packed & ((1 << 36) - 1)
+        if sample_rate == 0:
+            raise UploadRejected(400, "Corrupt FLAC header: sample rate is 0")
+        if total_samples:
+            self.check_duration(total_samples / sample_rate)
+
+    def end(self):
+        if not self._streaminfo_checked:
+            raise UploadRejected(400, "Corrupt FLAC header: file is truncated")
+        self._file.close()
+
+    def decode(self) -> tuple:
+        self._file.close()
+        if self.kind in ("flac", "wav", "rifx"):
+            audio, sample_rate = read_container(self.path)
+        else:
+            audio, sample_rate = librosa.load(self.path, sr=None)
+        self.check_duration(len(audio) / sample_rate)
+        return audio, sample_rate
+
+    def close(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class WavSink(StreamingSink):
+    """
+    RIFF/WAVE parsed from its first bytes. PCM16, float32, mu-law and A-law data are
+    decoded as it streams in; other encodings fall back to spooling for soundfile.
+    """
+
+    # (format tag, bits per sample) -> decode_raw codec; WAV samples are little-endian
+    STREAMABLE = {
+        (WAVE_FORMAT_PCM, 16): "l16",
+        (WAVE_FORMAT_IEEE_FLOAT, 32): "f32",
+        (WAVE_FORMAT_MULAW, 8): "ulaw",
+        (WAVE_FORMAT_ALAW, 8): "alaw",
+    }
+
+    def __init__(self, limits: UploadLimits):
+        super().__init__(limits)
+        self._header = b""
+        self._encoding = None
+        self._channels = None
+        self._block_align = None
+        self._data_remaining = None
+        self._carry = b""
+        self._spool = None
+
+    def _write(self, chunk: bytes):
+        if self._spool is not None:
+            self._spool.write(chunk)
+            return
+        if self._encoding is None:
+            self._header += chunk
+            data = self._parse_header()
+            if data is None:
+                if len(self._header) > MAX_WAV_HEADER_BYTES:
+                    raise UploadRejected(400, "Corrupt WAV header: no data chunk found")
+                return
+            if self._spool is not None:
+                return
+            self._header = b""
+            chunk = data
+        self._decode_chunk(chunk)
+
+    def _parse_header(self) -> Optional[bytes]:
+        """Parse fmt and locate data; returns the bytes after the data chunk header, or None if incomplete."""
+        header = self._header
+        fmt = None
+        offset = 12
+        while offset + 8 <= len(header):
+            chunk_id, size = struct.unpack("<4sI", header[offset:offset + 8])
+            body = offset + 8
+            if chunk_id == b"data":
+                if fmt is None:
+                    raise UploadRejected(400, "Corrupt WAV header: data chunk before fmt chunk")
+                self._start_data(fmt, size)
+                return header[body:]
+            if chunk_id == b"fmt ":
+                if body + min(size, 16) > len(header):
+                    return None
+                if size < 16:
+                    raise UploadRejected(400, "Corrupt WAV header: fmt chunk too short")
+                fmt = struct.unpack("<HHIIHH", header[body:body + 16])
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                    if body + 26 > len(header):
+                        return None
+                    subformat = struct.unpack("<H", header[body + 24:body + 26])[0]
+                    fmt = (subformat,) + fmt[1:]
+            offset = body + size + (size & 1)
+        return None
+
+    def _start_data(self, fmt: tuple, data_size: int):
+        audio_format, channels, sample_rate, byte_rate, block_align, bits = fmt
+        if channels == 0 or sample_rate == 0 or block_align == 0 or byte_rate == 0:
+            raise UploadRejected(400, "Corrupt WAV header: invalid fmt chunk")
+        # 0 and 0xFFFFFFFF mean "unknown" in WAVs written by streaming encoders
+        if data_size not in (0, 0xFFFFFFFF):
+            self.check_duration(data_size / byte_rate)
+            self._data_remaining = data_size
+
+        self.sample_rate = sample_rate
+        self._channels = channels
+        self._block_align = block_align
+        self._encoding = self.STREAMABLE.get((audio_format, bits))
+        if self._encoding is not None and block_align != channels * bits // 8:
+            raise UploadRejected(400, f"Corrupt WAV header: block align {block_align} does not match {channels} x {bits}-bit")
+        if self._encoding is None:
+            logger.info(f"WAV format {audio_format}/{bits}-bit is not streamable, spooling to disk")
+            self._spool = SpoolSink(UploadLimits(), "wav")
+            # Everything received so far: the header plus any data bytes that came with it
+            self._spool.write(self._header)
+
+    def _decode_chunk(self, chunk: bytes):
+        if self._data_remaining is not None:
+            chunk = chunk[:self._data_remaining]
+            self._data_remaining -= len(chunk)
+        chunk = self._carry + chunk
+        usable = len(chunk) - len(chunk) % self._block_align
+        self._carry = chunk[usable:]
+        if not usable:
+            return
+
+        samples = decode_raw(chunk[:usable], self._encoding, "little")
+        if self._channels > 1:
+            samples = samples.reshape(-1, self._channels).mean(axis=1)
+        self._append(samples)
+
+    def end(self):
+        if self._encoding is None and self._spool is None:
+            raise UploadRejected(400, "Corrupt WAV header: no data chunk found")
+        if self._spool is not None:
+            self._spool.end()
+
+    def decode(self) -> tuple:
+        if self._spool is not None:
+            audio, sample_rate = self._spool.decode()
+            self.check_duration(len(audio) / sample_rate)
+            return audio, sample_rate
+        return super().decode()
+
+    def close(self):
+        if self._spool is not None:
+            self._spool.close()
+
+
+class SniffingSink(AudioSink):
+    """Buffers the first bytes of a container upload, then hands off to the sink for its format."""
+
+    def __init__(self, limits: UploadLimits):
+        super().__init__(limits)
+        self._head = b""
+        self.target = None
+
+    def write(self, chunk: bytes):
+        # Size is counted by the target sink
+        if self.target is None:
+            self._head += chunk
+            if len(self._head) < SNIFF_BYTES:
+                return
+            self._open_target()
+            chunk, self._head = self._head, b""
+        self.target.write(chunk)
+
+    def _open_target(self):
+        kind = sniff_container(self._head)
+        if kind is None:
+            raise UploadRejected(400, "Unrecognised or corrupt audio header")
+        self.target = WavSink(self.limits) if kind == "wav" else SpoolSink(self.limits, kind)
+
+    def end(self):
+        if self.target is None:
+            self._open_target()
+            self.target.write(self._head)
+        self.target.end()
+
+    def decode(self) -> tuple:
+        return self.target.decode()
+
+    def close(self):
+        if self.target is not None:
+            self.target.close()
+
+
+def open_sink(content_type: Optional[str], limits: UploadLimits) -> AudioSink:
+    if raw_codec(content_type) is not None:
+        return RawSink(limits, content_type)
+    return SniffingSink(limits)
+
+
+def decode_file(path: str, content_type: Optional[str] = None, limits: Optional[UploadLimits] = None,
+                chunk_size: int = 1 << 16) -> tuple:
+    """Decode a local audio file through the same sinks as uploads: (mono float32 samples, sample_rate)."""
+    sink = open_sink(content_type, limits or UploadLimits())
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                sink.write(chunk)
+        sink.end()
+        return sink.decode()
+    finally:
+        sink.close()
+
+
+async def receive_multipart(request, limits: UploadLimits, on_file: Callable[[str, Optional[str]], None],
+                            file_field: str = "file") -> tuple:
+    """
+    Stream a multipart/form-data request body, feeding the file part to an AudioSink
+    chunk by chunk. `on_file(filename, content_type)` validates the file part before
+    any of its bytes are accepted. Returns (form fields, sink); the caller owns the
+    sink and must close() it.
+    """
+    mime, params = parse_options_header(request.headers.get("content-type", ""))
+    if mime != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadRejected(415, "Expected a multipart/form-data upload")
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and limits.max_bytes is not None:
+        if int(content_length) > limits.max_bytes + MAX_FIELD_BYTES:
+            raise UploadRejected(413, f"Upload exceeds the {limits.max_bytes} byte limit")
+
+    fields, events = {}, []
+    part = {}
+
+    def on_header_field(data, start, end):
+        part["field"] = part.get("field", b"") + data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] = part.get("value", b"") + data[start:end]
+
+    def on_header_end():
+        part.setdefault("headers", {})[part.pop("field", b"").lower()] = part.pop("value", b"")
+
+    callbacks = {
+        "on_part_begin": lambda: events.append(("begin", None)),
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers", part.pop("headers", {}))),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+        "on_end": lambda: events.append(("finished", None)),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    sink = None
+    current = None  # (kind, name, buffer)
+    file_complete = finished = False
+    try:
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except FormParserError:
+                raise UploadRejected(400, "Invalid multipart data")
+
+            for event, data in events:
+                if event == "headers":
+                    _, disposition = parse_options_header(data.get(b"content-disposition", b""))
+                    name = disposition.get(b"name", b"").decode("latin-1")
+                    filename = disposition.get(b"filename")
+                    if name == file_field and filename is not None and sink is None:
+                        content_type = data.get(b"content-type", b"").decode("latin-1") or None
+                        on_file(filename.decode("utf-8", "replace"), content_type)
+                        sink = open_sink(content_type, limits)
+                        current = ("file", name, None)
+                    else:
+                        current = ("field", name, bytearray())
+                elif event == "data" and current is not None:
+                    if current[0] == "file":
+                        sink.write(data)
+                    else:
+                        current[2].extend(data)
+                        if len(current[2]) > MAX_FIELD_BYTES:
+                            raise UploadRejected(413, f"Form field '{current[1]}' is too large")
+                elif event == "end" and current is not None:
+                    if current[0] == "file":
+                        sink.end()
+                        file_complete = True
+                    else:
+                        fields[current[1]] = current[2].decode("utf-8", "replace")
+                    current = None
+                elif event == "finished":
+                    finished = True
+            events.clear()
+        parser.finalize()
+
+        if sink is None:
+            raise UploadRejected(400, "No file provided")
+        # A body cut short would otherwise be decoded, and transcribed, as a shorter file
+        if not (finished and file_complete):
+            raise UploadRejected(400, "Upload ended before the closing multipart boundary")
+    except BaseException:
+        if sink is not None:
+            sink.close()
+        raise
+
+    return fields, sink